@@ -14,9 +14,13 @@ setup(name='tap-toast',
           'requests==2.20.0',
           'backoff==1.3.2'
       ],
+      extras_require={
+          'parquet': ['pyarrow']
+      },
       entry_points='''
           [console_scripts]
           tap-toast=tap_toast:main
+          tap-toast-runner=tap_toast.runner:main
       ''',
       packages=['tap_toast'],
       include_package_data=True,
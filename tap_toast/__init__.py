@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import argparse
+import contextlib
 import json
 import sys
 import singer
@@ -8,6 +10,11 @@ from tap_toast.discover import discover_streams
 from tap_toast.sync import sync_stream
 from tap_toast.streams import STREAMS
 from tap_toast.context import Context
+from tap_toast.sink import SingerSink, FileSink, DEFAULT_BATCH_SIZE, DEFAULT_FLUSH_SECONDS
+from tap_toast.budget import Budget
+from tap_toast.plan import plan_sync
+from tap_toast.transport import RateLimiter
+from tap_toast.profiling import StreamProfiler
 
 
 LOGGER = singer.get_logger()
@@ -56,11 +63,53 @@ def ensure_credentials_are_authorized(client):
     client.is_authorized()
 
 
-def do_sync(client, catalog, state):
+def build_client(config, session=None, tokens=None, rate_limiter=None):
+    creds = {
+        "client_id": config['client_id'],
+        "client_secret": config['client_secret'],
+        "location_guid": config['location_guid'],
+        "start_date": config['start_date'],
+        "management_group_guid": config['management_group_guid'],
+        "auth_with_login": config.get('auth_with_login', True),
+        "business_date_lookback_hours": config.get('business_date_lookback_hours')
+    }
+    if rate_limiter is None and config.get('requests_per_second'):
+        rate_limiter = RateLimiter(config['requests_per_second'])
+    return Toast(session=session, tokens=tokens, rate_limiter=rate_limiter, **creds)
+
+
+def get_sink(config, out=None):
+    if config.get('output_dir'):
+        return FileSink(config['output_dir'],
+                        file_format=config.get('output_format', 'ndjson'),
+                        batch_size=config.get('output_batch_size', DEFAULT_BATCH_SIZE),
+                        out=out,
+                        location=config['location_guid'],
+                        flush_seconds=config.get('output_flush_seconds', DEFAULT_FLUSH_SECONDS))
+    return SingerSink(out)
+
+
+def stream_priority(stream, state, config):
+    # Full table streams are cheap and cannot resume, so they go first. Incremental
+    # streams follow, the one furthest behind first.
+    instance = STREAMS[stream.tap_stream_id](config=config)
+    if instance.replication_method != "INCREMENTAL":
+        return (0, "")
+    return (1, singer.utils.strftime(singer.utils.strptime_to_utc(instance.get_bookmark(state))))
+
+
+def do_sync(client, catalog, state, sink=None, max_runtime_seconds=None, config=None, profile_dir=None):
+    config = Context.config if config is None else config
+    sink = sink or SingerSink()
+    budget = Budget(max_runtime_seconds)
     ensure_credentials_are_authorized(client)
     selected_stream_names = get_selected_streams(catalog)
 
-    for stream in catalog.streams:
+    streams = catalog.streams
+    if max_runtime_seconds:
+        streams = sorted(streams, key=lambda stream: stream_priority(stream, state, config))
+
+    for stream in streams:
         stream_name = stream.tap_stream_id
 
         mdata = metadata.to_map(stream.metadata)
@@ -69,38 +118,74 @@ def do_sync(client, catalog, state):
             LOGGER.info("%s: Skipping - not selected", stream_name)
             continue
 
+        if budget.exhausted(stream_name):
+            LOGGER.info("%s: Skipping - time budget exhausted", stream_name)
+            continue
+
+        instance = STREAMS[stream_name](client, config)
+        instance.stream = stream
+        instance.budget = budget
+
         key_properties = metadata.get(mdata, (), 'table-key-properties')
-        singer.write_schema(stream_name, stream.schema.to_dict(), key_properties)
+        bookmark_properties = [instance.replication_key] if instance.replication_key else None
+        sink.write_schema(stream_name, stream.schema.to_dict(), key_properties, bookmark_properties)
 
         LOGGER.info("%s: Starting sync", stream_name)
-        instance = STREAMS[stream_name](client)
-        instance.stream = stream
-        counter_value = sync_stream(state, instance)
-        singer.write_state(state)
+        started = budget.clock()
+        with StreamProfiler(profile_dir, stream_name) if profile_dir else contextlib.nullcontext():
+            counter_value = sync_stream(state, instance, sink)
+        if instance.replication_method != "INCREMENTAL":
+            budget.observe(stream_name, budget.clock() - started)
+        sink.write_state(state)
         LOGGER.info("%s: Completed sync (%s rows)", stream_name, counter_value)
 
-    singer.write_state(state)
+    sink.write_state(state)
+    sink.close()
     LOGGER.info("Finished sync")
 
 
-@singer.utils.handle_top_exception(LOGGER)
-def main():
+def do_plan(client, catalog, state, config):
+    LOGGER.info("Starting plan")
+    ensure_credentials_are_authorized(client)
+    selected_stream_names = get_selected_streams(catalog)
+
+    instances = []
+    for stream in catalog.streams:
+        if stream.tap_stream_id in selected_stream_names:
+            instance = STREAMS[stream.tap_stream_id](client, config)
+            instance.stream = stream
+            instances.append(instance)
+
+    plan = plan_sync(instances, state, config)
+    json.dump(plan, sys.stdout, indent=2)
+    LOGGER.info("Finished plan")
+
+
+def parse_args():
+    # Options of our own are taken off the command line before singer parses the standard ones.
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--plan', action='store_true', help='Estimate the requests and time a sync needs without syncing')
+    parser.add_argument('--profile', metavar='DIR', nargs='?', const='profile', help='Write CPU and allocation profiles of each stream to DIR')
+    (tap_args, remaining) = parser.parse_known_args()
+    sys.argv = sys.argv[:1] + remaining
+
     parsed_args = singer.utils.parse_args(REQUIRED_CONFIG_KEYS)
+    parsed_args.plan = tap_args.plan
+    parsed_args.profile = tap_args.profile
+    return parsed_args
 
-    creds = {
-        "client_id": parsed_args.config['client_id'],
-        "client_secret": parsed_args.config['client_secret'],
-        "location_guid": parsed_args.config['location_guid'],
-        "start_date": parsed_args.config['start_date'],
-        "management_group_guid": parsed_args.config['management_group_guid'],
-        "auth_with_login": parsed_args.config.get('auth_with_login', True)
-    }
 
-    client = Toast(**creds)
+@singer.utils.handle_top_exception(LOGGER)
+def main():
+    parsed_args = parse_args()
+
+    client = build_client(parsed_args.config)
     Context.config = parsed_args.config
 
     if parsed_args.discover:
         do_discover(client)
+    elif parsed_args.catalog and parsed_args.plan:
+        do_plan(client, parsed_args.catalog, parsed_args.state or {}, parsed_args.config)
     elif parsed_args.catalog:
         state = parsed_args.state or {}
-        do_sync(client, parsed_args.catalog, state)
+        do_sync(client, parsed_args.catalog, state, get_sink(parsed_args.config), parsed_args.config.get('max_runtime_seconds'), parsed_args.config, parsed_args.profile)
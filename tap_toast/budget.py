@@ -0,0 +1,50 @@
+
+#
+# Module dependencies.
+#
+
+import time
+import singer
+
+
+logger = singer.get_logger()
+DEFAULT_UNIT_SECONDS = 60.0
+
+
+class Budget():
+    """ Wall clock budget for a sync run.
+
+    The budget counts as exhausted for a stream once the time left is shorter
+    than the slowest unit of work (a window or a full table stream) that stream
+    has taken so far, so work that is started can be expected to finish inside
+    the budget. A stream with nothing measured yet expects its first unit to take
+    as long as the slowest of any stream, and at least `default_seconds`.
+    """
+
+    def __init__(self, max_runtime_seconds=None, default_seconds=DEFAULT_UNIT_SECONDS, clock=time.monotonic):
+        self.max_runtime_seconds = max_runtime_seconds
+        self.default_seconds = default_seconds
+        self.clock = clock
+        self.started = clock()
+        self.slowest = {}
+
+
+    def remaining(self):
+        if not self.max_runtime_seconds:
+            return None
+        return self.max_runtime_seconds - (self.clock() - self.started)
+
+
+    def expected(self, stream_name):
+        if stream_name in self.slowest:
+            return self.slowest[stream_name]
+        return max([self.default_seconds] + list(self.slowest.values()))
+
+
+    def observe(self, stream_name, seconds):
+        self.slowest[stream_name] = max(self.slowest.get(stream_name, 0.0), seconds)
+
+
+    def exhausted(self, stream_name):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= self.expected(stream_name)
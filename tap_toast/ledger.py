@@ -0,0 +1,102 @@
+
+#
+# Module dependencies.
+#
+
+import time
+import pytz
+import singer
+from singer import utils
+
+
+logger = singer.get_logger()
+LEDGER_KEY = 'completed_windows'
+
+
+def parse_utc(value):
+    return utils.strptime_with_tz(value).astimezone(pytz.utc)
+
+
+class WindowLedger():
+    """ Tracks which sync windows of an incremental stream have been fully emitted.
+
+    Completed windows are kept in the state as `[start, end]` pairs next to the
+    stream's bookmark. As soon as the windows following the bookmark form a
+    contiguous run they are folded into the bookmark itself, so a finished
+    sync leaves nothing but a plain bookmark behind.
+
+    When a `Budget` is given, no new window is handed out once it is exhausted.
+    """
+
+    def __init__(self, state=None, stream_name=None, replication_key=None, start_date=None, checkpoint=None, budget=None):
+        self.state = state if state is not None else {}
+        self.stream_name = stream_name
+        self.replication_key = replication_key
+        self.start_date = start_date
+        self.checkpoint = checkpoint
+        self.budget = budget
+        self.current = None
+        self.windows = [(parse_utc(start), parse_utc(end))
+                        for (start, end) in singer.get_bookmark(self.state, stream_name, LEDGER_KEY) or []]
+
+
+    def frontier(self):
+        bookmark = singer.get_bookmark(self.state, self.stream_name, self.replication_key) or self.start_date
+        return parse_utc(bookmark) if bookmark else None
+
+
+    def is_complete(self, start, end):
+        frontier = self.frontier()
+        if frontier is not None and end <= frontier:
+            return True
+        return any(done_start <= start and end <= done_end for (done_start, done_end) in self.windows)
+
+
+    def clock(self):
+        return time.monotonic() if self.budget is None else self.budget.clock()
+
+
+    def exhausted(self):
+        return self.budget is not None and self.budget.exhausted(self.stream_name)
+
+
+    def observe(self, seconds):
+        if self.budget is not None:
+            self.budget.observe(self.stream_name, seconds)
+
+
+    def pending(self, windows):
+        for (start, end) in windows:
+            if self.is_complete(start, end):
+                logger.info('{stream}: Skipping completed window {start} - {end}'.format(stream=self.stream_name, start=start, end=end))
+                continue
+            if self.exhausted():
+                logger.info('{stream}: Time budget exhausted, stopping before window {start} - {end}'.format(stream=self.stream_name, start=start, end=end))
+                return
+            started = self.clock()
+            self.current = (start, end)
+            yield (start, end)
+            self.current = None
+            self.observe(self.clock() - started)
+
+
+    def mark_complete(self, start, end):
+        self.windows.append((start, end))
+        self.compact()
+        if self.checkpoint is not None:
+            self.checkpoint()
+
+
+    def compact(self):
+        frontier = self.frontier()
+        self.windows.sort()
+        if frontier is not None:
+            while self.windows and self.windows[0][0] <= frontier:
+                frontier = max(frontier, self.windows.pop(0)[1])
+            singer.write_bookmark(self.state, self.stream_name, self.replication_key, utils.strftime(frontier))
+
+        if self.windows:
+            singer.write_bookmark(self.state, self.stream_name, LEDGER_KEY,
+                                  [[utils.strftime(start), utils.strftime(end)] for (start, end) in self.windows])
+        elif LEDGER_KEY in self.state.get('bookmarks', {}).get(self.stream_name, {}):
+            del self.state['bookmarks'][self.stream_name][LEDGER_KEY]
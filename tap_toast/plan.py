@@ -0,0 +1,144 @@
+
+#
+# Module dependencies.
+#
+
+import re
+import copy
+import time
+import collections
+import singer
+from tap_toast.ledger import WindowLedger
+
+
+logger = singer.get_logger()
+GUID = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+DEFAULT_REQUEST_SECONDS = 0.5
+
+
+class RequestRecorder():
+    """ Stands in for `Toast._get`, counting requests per endpoint.
+
+    Unless `fetch` is set no request is made and every call returns no records,
+    which walks a stream's windows and pages exactly as a sync with no data would.
+    """
+
+    def __init__(self, client, fetch=False):
+        self.client = client
+        self.fetch = fetch
+        self.get = client._get
+        self.requests = collections.Counter()
+        self.fetched = 0
+        self.seconds = 0.0
+
+
+    def endpoint(self, url):
+        return GUID.sub('{guid}', url[len(self.client.host):])
+
+
+    def __call__(self, url, **kwargs):
+        self.requests[self.endpoint(url)] += 1
+        if not self.fetch:
+            return []
+        started = time.monotonic()
+        res = self.get(url, **kwargs)
+        self.seconds += time.monotonic() - started
+        self.fetched += 1
+        return res
+
+
+class PlanLedger(WindowLedger):
+    """ A ledger that counts pending windows, handing out only the last `limit` of them when given.
+
+    Partial windows, such as today's orders so far, would understate a window's
+    records and pages, so only full length windows are sampled.
+    """
+
+    def __init__(self, state, stream_name, replication_key, start_date, limit=None):
+        super().__init__(copy.deepcopy(state), stream_name, replication_key, start_date)
+        self.limit = limit
+        self.count = 0
+        self.sampled = 0
+
+
+    def pending(self, windows):
+        windows = list(super().pending(windows))
+        self.count = len(windows)
+        if self.limit:
+            longest = max((end - start for (start, end) in windows), default=None)
+            windows = [(start, end) for (start, end) in windows if end - start == longest][-self.limit:]
+        self.sampled = len(windows)
+        return iter(windows)
+
+
+    def mark_complete(self, start, end):
+        pass
+
+
+def walk(instance, state, recorder, limit=None):
+    """ Runs a stream against `recorder`, returning its pending windows, the windows walked and the records seen. """
+    get_data = getattr(instance.client, instance.name)
+    bookmark = instance.get_bookmark(state)
+    instance.client._get = recorder
+    try:
+        if instance.windowed:
+            ledger = PlanLedger(state, instance.name, instance.replication_key, bookmark, limit)
+            records = sum(1 for _ in get_data(instance.replication_key, bookmark, ledger=ledger))
+            return (ledger.count, ledger.sampled, records)
+        return (None, None, sum(1 for _ in get_data(instance.replication_key, bookmark)))
+    finally:
+        del instance.client._get
+
+
+def plan_stream(instance, state, sample_windows=0):
+    recorder = RequestRecorder(instance.client)
+    (windows, _, _) = walk(instance, state, recorder)
+    stream_plan = {'windows': windows, 'requests': dict(recorder.requests), 'calibrated': False}
+
+    if windows and sample_windows:
+        sample = RequestRecorder(instance.client, fetch=True)
+        (_, sampled, records) = walk(instance, state, sample, sample_windows)
+        stream_plan.update({
+            'requests': {endpoint: int(round(count * windows / sampled)) for (endpoint, count) in sample.requests.items()},
+            'sampled_windows': sampled,
+            'records_per_window': records / sampled,
+            'calibrated': True,
+            'request_seconds': sample.seconds / sample.fetched if sample.fetched else None,
+        })
+
+    return stream_plan
+
+
+def estimate_seconds(requests, request_seconds, requests_per_second=None):
+    """ Requests are made one after another, so the estimate is their total latency, or the rate limit if slower. """
+    seconds = requests * request_seconds
+    if requests_per_second:
+        seconds = max(seconds, requests / requests_per_second)
+    return seconds
+
+
+def plan_sync(instances, state, config):
+    """ Estimates the requests and time a sync of `instances` from `state` needs, without syncing. """
+    sample_windows = config.get('plan_sample_windows', 0)
+    streams = {}
+    totals = collections.Counter()
+    latencies = []
+
+    for instance in instances:
+        logger.info('{stream}: Planning'.format(stream=instance.name))
+        stream_plan = plan_stream(instance, state, sample_windows)
+        streams[instance.name] = stream_plan
+        totals.update(stream_plan['requests'])
+        if stream_plan.get('request_seconds'):
+            latencies.append(stream_plan['request_seconds'])
+
+    request_seconds = sum(latencies) / len(latencies) if latencies else DEFAULT_REQUEST_SECONDS
+    total_requests = sum(totals.values())
+    return {
+        'streams': streams,
+        'requests': dict(totals),
+        'total_requests': total_requests,
+        'request_seconds': request_seconds,
+        'requests_per_second': config.get('requests_per_second'),
+        'estimated_seconds': estimate_seconds(total_requests, request_seconds, config.get('requests_per_second')),
+    }
@@ -0,0 +1,141 @@
+
+#
+# Module dependencies.
+#
+
+import os
+import io
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import collections
+import singer
+
+
+logger = singer.get_logger()
+DEFAULT_SAMPLE_INTERVAL = 0.005
+MEMORY_CHECK_INTERVAL = 0.1
+MAX_SNAPSHOTS = 5
+SNAPSHOT_GROWTH = 1.25
+MIN_SNAPSHOT_BYTES = 1024 * 1024
+TOP_ENTRIES = 30
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+]
+
+
+def frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__') or os.path.basename(code.co_filename)
+    return '{module}:{function}'.format(module=module, function=code.co_name)
+
+
+class StreamProfiler():
+    """ Profiles the code run inside it on the current thread and reports on it per stream.
+
+    Writes to `output_dir`:
+
+    - `<stream>.txt`: the top functions by cumulative and own time (cProfile),
+      the peak traced memory, and the top allocation sites by the most memory
+      they held in any snapshot (tracemalloc). Up to `max_snapshots` are taken,
+      each when traced memory has grown by a quarter since the last one (and
+      past 1 MiB), plus one at the end.
+    - `<stream>.collapsed`: stacks sampled every `interval` seconds, one
+      `frame;frame;frame count` line per stack, as read by flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, output_dir, stream_name, interval=DEFAULT_SAMPLE_INTERVAL, max_snapshots=MAX_SNAPSHOTS):
+        self.output_dir = output_dir
+        self.stream_name = stream_name
+        self.interval = interval
+        self.max_snapshots = max_snapshots
+        self.profiler = cProfile.Profile()
+        self.stacks = collections.Counter()
+        self.sites = {}
+        self.snapshots = 0
+        self.snapshot_size = 0
+        self.peak_memory = 0
+        self.stopped = threading.Event()
+        self.thread_id = None
+        self.threads = []
+        self.started = None
+
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        tracemalloc.start()
+        # snapshots get a thread of their own so copying the traces never holds up stack sampling
+        self.threads = [threading.Thread(target=target, daemon=True) for target in (self.sample, self.watch_memory)]
+        for thread in self.threads:
+            thread.start()
+        self.started = time.monotonic()
+        self.profiler.enable()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        elapsed = time.monotonic() - self.started
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+        self.snapshot()
+        self.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.write_reports(elapsed)
+        return False
+
+
+    def snapshot(self):
+        # keep the largest size each site reached, memory freed before the end still counts
+        self.snapshots += 1
+        self.snapshot_size = tracemalloc.get_traced_memory()[0]
+        for stat in tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS).statistics('lineno'):
+            peak = self.sites.get(stat.traceback)
+            if peak is None or stat.size > peak.size:
+                self.sites[stat.traceback] = stat
+
+
+    def watch_memory(self):
+        # snapshots copy every trace, so only a few are taken, near the memory high points
+        while self.snapshots < self.max_snapshots and not self.stopped.wait(MEMORY_CHECK_INTERVAL):
+            if tracemalloc.get_traced_memory()[0] > max(self.snapshot_size * SNAPSHOT_GROWTH, MIN_SNAPSHOT_BYTES):
+                self.snapshot()
+
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+    def write_reports(self, elapsed):
+        os.makedirs(self.output_dir, exist_ok=True)
+        report_path = os.path.join(self.output_dir, '{}.txt'.format(self.stream_name))
+        collapsed_path = os.path.join(self.output_dir, '{}.collapsed'.format(self.stream_name))
+
+        out = io.StringIO()
+        out.write('{stream}: {elapsed:.3f}s, {samples} stack samples\n\n'.format(stream=self.stream_name, elapsed=elapsed, samples=sum(self.stacks.values())))
+        for sort_key in ('cumulative', 'tottime'):
+            out.write('Top functions by {}\n'.format(sort_key))
+            pstats.Stats(self.profiler, stream=out).sort_stats(sort_key).print_stats(TOP_ENTRIES)
+        out.write('Peak traced memory: {:.1f} MiB\n\n'.format(self.peak_memory / 1024.0 / 1024.0))
+        out.write('Top allocation sites by peak size over {} snapshots\n\n'.format(self.snapshots))
+        for stat in sorted(self.sites.values(), key=lambda stat: stat.size, reverse=True)[:TOP_ENTRIES]:
+            out.write('{}\n'.format(stat))
+
+        with open(report_path, 'w') as f:
+            f.write(out.getvalue())
+        with open(collapsed_path, 'w') as f:
+            for (stack, count) in self.stacks.most_common():
+                f.write('{stack} {count}\n'.format(stack=stack, count=count))
+        logger.info('{stream}: Wrote profile to {path}'.format(stream=self.stream_name, path=report_path))
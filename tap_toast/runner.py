@@ -0,0 +1,104 @@
+
+#
+# Module dependencies.
+#
+
+import os
+import json
+import time
+import argparse
+import singer
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from singer.catalog import Catalog
+from tap_toast import REQUIRED_CONFIG_KEYS, build_client, get_sink, do_sync
+from tap_toast.transport import RateLimiter, TokenCache, pooled_session
+
+
+LOGGER = singer.get_logger()
+DEFAULT_MAX_WORKERS = 4
+
+
+class Tenant():
+    """ One config, catalog and state synced by the runner.
+
+    Singer messages go to `output` (a file or named pipe, appended to), which
+    every tenant needs as stdout is shared by all of them. The state is saved
+    back to `state` after every sync.
+    """
+
+    def __init__(self, config, catalog, output, state=None, name=None):
+        self.config = singer.utils.load_json(config)
+        singer.utils.check_config(self.config, REQUIRED_CONFIG_KEYS)
+        self.catalog = Catalog.load(catalog)
+        self.state_path = state
+        self.state = singer.utils.load_json(state) if state and os.path.exists(state) else {}
+        self.output = output
+        self.name = name or self.config['location_guid']
+        self.client = None
+
+
+    def sync(self, session, tokens, rate_limiter):
+        if self.client is None:
+            self.client = build_client(self.config, session, tokens, rate_limiter)
+
+        LOGGER.info("%s: Starting tenant sync", self.name)
+        with open(self.output, 'a') as out:
+            do_sync(self.client, self.catalog, self.state, get_sink(self.config, out),
+                    self.config.get('max_runtime_seconds'), self.config)
+        self.save_state()
+        LOGGER.info("%s: Finished tenant sync", self.name)
+
+
+    def save_state(self):
+        if not self.state_path:
+            return
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.state_path)
+
+
+def run(tenants, max_workers=DEFAULT_MAX_WORKERS, requests_per_second=None, interval_seconds=None):
+    """ Syncs every tenant on one worker pool, sharing the HTTP session, auth tokens and rate limit.
+
+    With `interval_seconds` the tenants are synced again every interval, forever.
+    Returns the names of the tenants that failed in the last round.
+    """
+    session = pooled_session(max_workers)
+    tokens = TokenCache()
+    rate_limiter = RateLimiter(requests_per_second) if requests_per_second else None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            started = time.monotonic()
+            futures = {pool.submit(tenant.sync, session, tokens, rate_limiter): tenant for tenant in tenants}
+            failed = []
+            for future in as_completed(futures):
+                tenant = futures[future]
+                try:
+                    future.result()
+                except Exception:
+                    LOGGER.exception("%s: Tenant sync failed", tenant.name)
+                    failed.append(tenant.name)
+
+            if not interval_seconds:
+                return failed
+            time.sleep(max(0, interval_seconds - (time.monotonic() - started)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync many Toast configs from one process')
+    parser.add_argument('-c', '--config', help='Runner config file', required=True)
+    args = parser.parse_args()
+
+    config = singer.utils.load_json(args.config)
+    missing = [spec.get('name', spec['config']) for spec in config['tenants'] if not spec.get('output')]
+    if missing:
+        raise SystemExit("Tenants need an output: {}".format(", ".join(missing)))
+    tenants = [Tenant(**spec) for spec in config['tenants']]
+    failed = run(tenants,
+                 max_workers=config.get('max_workers', DEFAULT_MAX_WORKERS),
+                 requests_per_second=config.get('requests_per_second'),
+                 interval_seconds=config.get('interval_seconds'))
+    if failed:
+        raise SystemExit("Tenant syncs failed: {}".format(", ".join(failed)))
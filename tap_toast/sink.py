@@ -0,0 +1,205 @@
+
+#
+# Module dependencies.
+#
+
+import os
+import copy
+import time
+import gzip
+import json
+import datetime
+import pytz
+import singer
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+ARROW_SCALARS = {
+    'string': lambda: pyarrow.string(),
+    'integer': lambda: pyarrow.int64(),
+    'number': lambda: pyarrow.float64(),
+    'boolean': lambda: pyarrow.bool_(),
+}
+
+
+logger = singer.get_logger()
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_FLUSH_SECONDS = 300
+FULL_TABLE_PARTITION = 'full_table'
+
+
+def arrow_column(schema):
+    """ Returns the Arrow type for a JSON schema and a function converting values to it.
+
+    Values whose schema has no single Arrow equivalent (several types, no declared
+    properties or items) are stored as JSON strings.
+    """
+    types = schema.get('type', [])
+    types = [t for t in ([types] if isinstance(types, str) else types) if t != 'null']
+    typ = types[0] if len(types) == 1 else None
+
+    if typ in ARROW_SCALARS and 'format' not in schema:
+        return (ARROW_SCALARS[typ](), lambda value: value)
+
+    if typ == 'object' and schema.get('properties'):
+        columns = [(name, arrow_column(sub_schema)) for (name, sub_schema) in schema['properties'].items()]
+        arrow_type = pyarrow.struct([pyarrow.field(name, column_type) for (name, (column_type, _)) in columns])
+        def convert(value):
+            if value is None:
+                return None
+            return {name: column_convert(value.get(name)) for (name, (_, column_convert)) in columns}
+        return (arrow_type, convert)
+
+    if typ == 'array' and schema.get('items'):
+        (item_type, item_convert) = arrow_column(schema['items'])
+        return (pyarrow.list_(item_type), lambda value: None if value is None else [item_convert(item) for item in value])
+
+    return (pyarrow.string(), lambda value: None if value is None or isinstance(value, str) else json.dumps(value))
+
+
+class SingerSink():
+    """ Writes Singer messages to stdout, or to `out` when given. """
+
+    def __init__(self, out=None):
+        self.out = out
+
+
+    def write_message(self, message):
+        if self.out is None:
+            singer.write_message(message)
+            return
+        self.out.write(singer.format_message(message) + '\n')
+        self.out.flush()
+
+
+    def write_schema(self, stream_name, schema, key_properties, bookmark_properties=None):
+        self.write_message(singer.SchemaMessage(stream=stream_name, schema=schema, key_properties=key_properties, bookmark_properties=bookmark_properties))
+
+
+    def write_record(self, stream_name, record, business_date=None):
+        self.write_message(singer.RecordMessage(stream=stream_name, record=record))
+
+
+    def write_state(self, state):
+        self.write_message(singer.StateMessage(value=state))
+
+
+    def flush(self):
+        pass
+
+
+    def close(self):
+        pass
+
+
+class FileSink(SingerSink):
+    """ Writes records to local files partitioned by stream and business date.
+
+    Records are buffered and written in batches as gzipped NDJSON, or as Parquet
+    when `file_format` is "parquet" and pyarrow is installed. STATE is held back
+    and only the latest one goes out after the next batch has been written, so
+    a bookmark never gets ahead of the data on disk while files still cover many
+    windows. A batch is also written when `flush_seconds` have passed since the
+    last one, and STATE covering no buffered records goes out right away, so
+    sparse syncs checkpoint too. SCHEMA and RECORD messages are not sent to `out`; STATE is.
+    A manifest of the files written is saved next to them when the sink closes.
+    File and manifest names carry `location` so several locations can share `output_dir`.
+    """
+
+    def __init__(self, output_dir, file_format='ndjson', batch_size=DEFAULT_BATCH_SIZE, out=None, location=None, flush_seconds=DEFAULT_FLUSH_SECONDS):
+        super().__init__(out)
+        if file_format == 'parquet' and pyarrow is None:
+            logger.warning('pyarrow is not installed, writing ndjson files instead of parquet.')
+            file_format = 'ndjson'
+        if file_format not in ('ndjson', 'parquet'):
+            raise ValueError('Unsupported output file format: {}'.format(file_format))
+
+        self.output_dir = output_dir
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.flushed_at = time.monotonic()
+        self.location = location
+        self.run_id = datetime.datetime.now(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
+        self.buffers = {}
+        self.buffered = 0
+        self.files = []
+        self.state = None
+        self.pending_state = None
+        self.arrow_columns = {}
+
+
+    def write_schema(self, stream_name, schema, key_properties, bookmark_properties=None):
+        self.buffers.setdefault(stream_name, {})
+        if self.file_format == 'parquet':
+            # every batch of a stream gets the same columns and types, taken from the catalog
+            self.arrow_columns[stream_name] = arrow_column(schema)
+
+
+    def write_record(self, stream_name, record, business_date=None):
+        partition = business_date or FULL_TABLE_PARTITION
+        self.buffers.setdefault(stream_name, {}).setdefault(partition, []).append(record)
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+
+    def write_state(self, state):
+        # every record the state covers is already buffered, so it can go out after the next flush
+        self.pending_state = copy.deepcopy(state)
+        if self.buffered == 0 or time.monotonic() - self.flushed_at >= self.flush_seconds:
+            self.flush()
+
+
+    def flush(self):
+        for (stream_name, partitions) in self.buffers.items():
+            for (partition, records) in partitions.items():
+                if records:
+                    self.write_file(stream_name, partition, records)
+            self.buffers[stream_name] = {}
+        self.buffered = 0
+        self.flushed_at = time.monotonic()
+
+        if self.pending_state is not None:
+            self.state = self.pending_state
+            self.pending_state = None
+            super().write_state(self.state)
+
+
+    def file_name(self, prefix, extension, number=None):
+        parts = [prefix, self.location, self.run_id, None if number is None else '{:05d}'.format(number)]
+        return '{name}.{extension}'.format(name='-'.join(part for part in parts if part), extension=extension)
+
+
+    def write_file(self, stream_name, partition, records):
+        directory = os.path.join(self.output_dir, stream_name, 'business_date={}'.format(partition))
+        os.makedirs(directory, exist_ok=True)
+        extension = 'parquet' if self.file_format == 'parquet' else 'ndjson.gz'
+        path = os.path.join(directory, self.file_name('part', extension, len(self.files)))
+
+        if self.file_format == 'parquet':
+            (arrow_type, convert) = self.arrow_columns[stream_name]
+            table = pyarrow.Table.from_pylist([convert(record) for record in records], schema=pyarrow.schema(list(arrow_type)))
+            pyarrow.parquet.write_table(table, path)
+        else:
+            with gzip.open(path, 'wt', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+
+        logger.info('Wrote {number} {stream} records to {path}'.format(number=len(records), stream=stream_name, path=path))
+        self.files.append({'stream': stream_name, 'business_date': partition, 'path': os.path.relpath(path, self.output_dir), 'records': len(records), 'format': self.file_format})
+
+
+    def close(self):
+        self.flush()
+        manifest = {'run_id': self.run_id, 'location': self.location, 'files': self.files, 'state': self.state}
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, self.file_name('manifest', 'json'))
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        logger.info('Wrote manifest of {number} files to {path}'.format(number=len(self.files), path=path))
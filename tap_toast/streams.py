@@ -13,6 +13,7 @@ from singer import utils
 from singer.metrics import Point
 from dateutil.parser import parse
 from tap_toast.context import Context
+from tap_toast.ledger import WindowLedger
 
 
 logger = singer.get_logger()
@@ -33,6 +34,71 @@ def needs_parse_to_date(string):
     return False
 
 
+# Types the Transformer returns unchanged when a value already has that type.
+PASSTHROUGH_TYPES = {"null", "string", "boolean", "object", "array"}
+
+
+def compile_projection(schema):
+    """ Compiles `schema` into a function returning a record exactly as the Transformer would.
+
+    The function drops keys the schema does not declare, like the Transformer, and
+    raises ValueError for any value the Transformer would have to coerce. Returns
+    None when the schema uses anything the projection does not handle.
+    """
+    if "format" in schema or "anyOf" in schema or "patternProperties" in schema:
+        return None
+    if "type" not in schema:
+        return lambda value: value
+    types = schema["type"]
+    types = [types] if isinstance(types, str) else list(types)
+    if any(t not in PASSTHROUGH_TYPES for t in types):
+        return None
+    # the Transformer tries null last
+    types = [t for t in types if t != "null"] + [t for t in types if t == "null"]
+
+    properties = None
+    if "object" in types and schema.get("properties"):
+        properties = {name: compile_projection(sub_schema) for (name, sub_schema) in schema["properties"].items()}
+        if any(project is None for project in properties.values()):
+            return None
+    items = None
+    if "array" in types:
+        items = compile_projection(schema["items"]) if "items" in schema else None
+        if items is None:
+            return None
+
+    if types == ["string", "null"]:
+        # by far the most common field, kept to a single check
+        def project_string(value):
+            if value is None or isinstance(value, str):
+                return value
+            raise ValueError("string would be coerced")
+        return project_string
+
+    def project(value):
+        for typ in types:
+            if typ == "string":
+                if isinstance(value, str):
+                    return value
+                if value is not None:
+                    raise ValueError("string would be coerced")
+            elif typ == "boolean":
+                if not isinstance(value, bool):
+                    raise ValueError("boolean would be coerced")
+                return value
+            elif typ == "object" and isinstance(value, dict):
+                if properties is None:
+                    return value
+                return {name: properties[name](item) for (name, item) in value.items() if name in properties}
+            elif typ == "array" and isinstance(value, list):
+                return [items(item) for item in value]
+            elif typ == "null" and (value is None or value == ""):
+                return None
+        raise ValueError("no type matches")
+
+    return project
+
+
 class Stream():
     name = None
     replication_method = None
@@ -40,14 +106,21 @@ class Stream():
     stream = None
     key_properties = KEY_PROPERTIES
     session_bookmark = None
+    windowed = False
+    passthrough = False
+    business_date_key = None
+    ledger = None
+    sink = None
+    budget = None
 
 
-    def __init__(self, client=None):
+    def __init__(self, client=None, config=None):
         self.client = client
+        self.config = Context.config if config is None else config
 
 
     def get_bookmark(self, state):
-        return (singer.get_bookmark(state, self.name, self.replication_key)) or Context.config["start_date"]
+        return (singer.get_bookmark(state, self.name, self.replication_key)) or self.config["start_date"]
 
 
     def update_bookmark(self, state, value):
@@ -90,10 +163,53 @@ class Stream():
         return self.stream is not None
 
 
+    def passthrough_projection(self):
+        # Passthrough skips the Transformer for records it would return unchanged apart
+        # from undeclared keys, which needs every field selected and a simple schema.
+        # raw_passthrough is the option's earlier name
+        if not (self.passthrough and (self.config.get("transform_fast_path") or self.config.get("raw_passthrough"))):
+            return None
+        mdata = metadata.to_map(self.stream.metadata)
+        schema = self.stream.schema.to_dict()
+        for field_name in schema["properties"].keys():
+            breadcrumb = ("properties", field_name)
+            if metadata.get(mdata, breadcrumb, "inclusion") == "automatic":
+                continue
+            if metadata.get(mdata, breadcrumb, "selected") is False or metadata.get(mdata, breadcrumb, "inclusion") == "unsupported":
+                return None
+        return compile_projection(schema)
+
+
+    def business_date(self, record):
+        # The business date a record belongs to, as YYYYMMDD: the record's own when the
+        # API returns one, otherwise the window being synced. None for full table streams.
+        if self.business_date_key and record.get(self.business_date_key):
+            return str(record[self.business_date_key])
+        if self.ledger is not None and self.ledger.current is not None:
+            return self.ledger.current[0].strftime("%Y%m%d")
+        return None
+
+
+    def checkpoint(self, state):
+        if self.sink is None:
+            singer.write_state(state)
+        else:
+            self.sink.write_state(state)
+
+
     # The main sync function.
     def sync(self, state):
         get_data = getattr(self.client, self.name)
         bookmark = self.get_bookmark(state)
+
+        if self.windowed:
+            # Windowed streams are bookmarked by the ledger once a whole window has been emitted.
+            ledger = WindowLedger(state, self.name, self.replication_key, bookmark, lambda: self.checkpoint(state), self.budget)
+            self.ledger = ledger
+            for item in get_data(self.replication_key, bookmark, ledger=ledger):
+                yield (self.stream, item)
+            return
+
         res = get_data(self.replication_key, bookmark)
 
         for item in res:
@@ -107,6 +223,7 @@ class CashManagementEntries(Stream):
     replication_method = "INCREMENTAL"
     replication_key = "date"
     key_properties = [ "guid" ]
+    windowed = True
 
 
 class CashManagementDeposits(Stream):
@@ -114,6 +231,7 @@ class CashManagementDeposits(Stream):
     replication_method = "INCREMENTAL"
     replication_key = "date"
     key_properties = [ "guid" ]
+    windowed = True
 
 
 class Employees(Stream):
@@ -127,6 +245,8 @@ class Orders(Stream):
     replication_method = "INCREMENTAL"
     replication_key = "modifiedDate"
     key_properties = [ "guid" ]
+    windowed = True
+    business_date_key = "businessDate"
 
 
 class Payments(Stream):
@@ -134,144 +254,168 @@ class Payments(Stream):
     replication_method = "INCREMENTAL"
     replication_key = "paidDate"
     key_properties = [ "guid" ]
+    windowed = True
 
 
 class AlternatePaymentTypes(Stream):
     name = "alternate_payment_types"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class BreakTypes(Stream):
     name = "break_types"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class CashDrawers(Stream):
     name = "cash_drawers"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class DiningOptions(Stream):
     name = "dining_options"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class Discounts(Stream):
     name = "discounts"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class MenuGroups(Stream):
     name = "menu_groups"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class MenuItems(Stream):
     name = "menu_items"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class MenuOptionGroups(Stream):
     name = "menu_option_groups"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class Menus(Stream):
     name = "menus"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class NoSaleReasons(Stream):
     name = "no_sale_reasons"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class PayoutReasons(Stream):
     name = "payout_reasons"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class PreModifierGroups(Stream):
     name = "premodifier_groups"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class PreModifiers(Stream):
     name = "premodifiers"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class PriceGroups(Stream):
     name = "price_groups"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class Printers(Stream):
     name = "printers"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class RestaurantServices(Stream):
     name = "restaurant_services"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class RevenueCenters(Stream):
     name = "revenue_centers"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class SalesCategories(Stream):
     name = "sales_categories"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class ServiceAreas(Stream):
     name = "service_areas"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class Tables(Stream):
     name = "tables"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class TaxRates(Stream):
     name = "tax_rates"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class TipWithholding(Stream):
     name = "tip_withholding"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class VoidReasons(Stream):
     name = "void_reasons"
     replication_method = "FULL_TABLE"
     key_properties = [ "guid" ]
+    passthrough = True
 
 
 class Restaurants(Stream):
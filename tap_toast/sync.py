@@ -4,24 +4,44 @@ import singer
 import singer.metrics as metrics
 from singer import metadata
 from singer import Transformer
+from tap_toast.sink import SingerSink
 
 
-def sync_stream(state, instance):
+LOGGER = singer.get_logger()
+
+
+def transform(record, stream, project=None):
+    if project is not None:
+        try:
+            return project(record)
+        except ValueError:
+            # a value needs coercing, leave it to the Transformer
+            pass
+    with Transformer() as transformer:
+        return transformer.transform(record, stream.schema.to_dict(), metadata.to_map(stream.metadata))
+
+
+def sync_stream(state, instance, sink=None):
     stream = instance.stream
+    sink = sink or SingerSink()
+    instance.sink = sink
 
     with metrics.record_counter(stream.tap_stream_id) as counter:
+        project = instance.passthrough_projection()
+        if project is not None:
+            LOGGER.info("%s: Passing records through without the Transformer", stream.tap_stream_id)
+
         for (stream, record) in instance.sync(state):
             counter.increment()
+            business_date = instance.business_date(record)
 
-            with Transformer() as transformer:
-                record = transformer.transform(record, stream.schema.to_dict(), metadata.to_map(stream.metadata))
-
-            singer.write_record(stream.tap_stream_id, record)
-            # NB: We will only write state at the end of a stream's sync:
-            #  We may find out that there exists a sync that takes too long and can never emit a bookmark
-            #  but we don't know if we can guarentee the order of emitted records.
+            record = transform(record, stream, project)
+            sink.write_record(stream.tap_stream_id, record, business_date)
+            # NB: Windowed streams checkpoint state as each window completes, see WindowLedger.
+            #  Other streams only write state at the end of a stream's sync since we
+            #  don't know if we can guarentee the order of emitted records.
 
         if instance.replication_method == "INCREMENTAL":
-            singer.write_state(state)
+            sink.write_state(state)
 
         return counter.value
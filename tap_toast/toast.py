@@ -12,9 +12,16 @@ import logging
 import pytz
 import sys
 import json
+from tap_toast.ledger import WindowLedger
 
 logger = logging.getLogger()
 utc = pytz.UTC
+# orders modified shortly before a request can show up in ordersBulk a little later,
+# so the last orders window stops this far short of now
+ORDERS_LOOKBACK = timedelta(minutes=15)
+# a business date stays open locally well past utc midnight (later still with a late
+# cutoff), so its window is only marked complete once this long after it ends
+BUSINESS_DATE_LOOKBACK = timedelta(hours=24)
 
 
 
@@ -33,10 +40,28 @@ def daterange(start_date, end_date):
 
 
 
+def business_date_windows(start_date, end_date):
+    for single_date in daterange(start_date, end_date):
+        yield (single_date, single_date + timedelta(1))
+
+
+
+def day_windows(start_date, end_date):
+    # windows are cut at utc midnight so their boundaries line up between runs
+    while start_date < end_date:
+        next_day = start_date.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(1)
+        yield (start_date, min(next_day, end_date))
+        start_date = next_day
+
+
+
 class Toast(object):
 
-    def __init__(self, client_id=None, client_secret=None, location_guid=None, management_group_guid=None, start_date=None, auth_with_login=True):
-        """ Simple Python wrapper for the Toast API. """
+    def __init__(self, client_id=None, client_secret=None, location_guid=None, management_group_guid=None, start_date=None, auth_with_login=True, session=None, tokens=None, rate_limiter=None, business_date_lookback_hours=None):
+        """ Simple Python wrapper for the Toast API.
+
+        `session`, `tokens` (a TokenCache) and `rate_limiter` may be shared between clients.
+        """
         self.host = 'https://ws-api.toasttab.com/'
         self.client_id = client_id
         self.client_secret = client_secret
@@ -50,6 +75,10 @@ class Toast(object):
         self.fmt_date_time = '%Y-%m-%dT%H:%M:%S.%Z'
         self.fmt_date = '%Y%m%d'
         self.default_page_size = 50
+        self.session = session or requests.Session()
+        self.tokens = tokens
+        self.rate_limiter = rate_limiter
+        self.business_date_lookback = BUSINESS_DATE_LOOKBACK if business_date_lookback_hours is None else timedelta(hours=business_date_lookback_hours)
         self.get_authorization_token()
         # print(self.authorization_token)
 
@@ -65,7 +94,10 @@ class Toast(object):
             self.get_authorization_token()
 
         header = { 'Authorization': 'Bearer ' + self.authorization_token, 'Toast-Restaurant-External-ID': self.location_guid, 'Content-Type': 'application/json' }
-        response = requests.post(url, headers=header)
+        self.wait_for_rate_limit()
+        response = self.session.post(url, headers=header)
+        if response.status_code == 401:
+            self.reset_authorization_token()
         response.raise_for_status()
         logger.info('POST request successful at {url}'.format(url=url))
         return response.json()
@@ -78,7 +110,11 @@ class Toast(object):
             self.get_authorization_token()
 
         header = { 'Authorization': 'Bearer ' + self.authorization_token, 'Toast-Restaurant-External-ID': self.location_guid, 'Content-Type': 'application/json' }
-        response = requests.get(url, headers=header, params=kwargs)
+        self.wait_for_rate_limit()
+        response = self.session.get(url, headers=header, params=kwargs)
+        if response.status_code == 401:
+            # the token has expired, log in again when the request is retried
+            self.reset_authorization_token()
         response.raise_for_status()
         logger.info('GET request successful at {url}'.format(url=url))
         try:
@@ -90,49 +126,80 @@ class Toast(object):
         return res
 
 
+    def is_business_date_closed(self, next_date):
+        # an open business date is still fetched, but left pending so the next run fetches it again
+        return next_date + self.business_date_lookback <= datetime.now(pytz.utc)
+
+
+    def wait_for_rate_limit(self):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+
     def is_authorized(self):
         return self.authorization_token is not None
 
 
     def get_authorization_token(self):
+        if self.tokens is None:
+            self.authorization_token = self.login()
+        else:
+            self.authorization_token = self.tokens.get(self.client_id, self.login)
+
+
+    def reset_authorization_token(self):
+        if self.tokens is not None:
+            self.tokens.invalidate(self.client_id, self.authorization_token)
+        self.authorization_token = None
+
+
+    def login(self):
         if self.auth_with_login:
             return self.get_authorization_token_with_login()
         payload = { 'grant_type': self.grant_type, 'client_id': self.client_id, 'client_secret': self.client_secret }
-        response = requests.post(self._url('usermgmt/v1/oauth/token'), data=payload)
+        self.wait_for_rate_limit()
+        response = self.session.post(self._url('usermgmt/v1/oauth/token'), data=payload)
         response.raise_for_status()
         res = response.json()
         logger.info('Authorization successful.')
-        self.authorization_token = res['access_token']
+        return res['access_token']
 
     def get_authorization_token_with_login(self):
         payload = { 'userAccessType': self.user_access_type, 'clientId': self.client_id, 'clientSecret': self.client_secret }
-        response = requests.post(self._url('authentication/v1/authentication/login'), json=payload, headers={ 'Content-Type': 'application/json' })
+        self.wait_for_rate_limit()
+        response = self.session.post(self._url('authentication/v1/authentication/login'), json=payload, headers={ 'Content-Type': 'application/json' })
         response.raise_for_status()
         res = response.json()
         logger.info('Authorization successful.')
-        self.authorization_token = res['token']['accessToken']
+        return res['token']['accessToken']
 
 
     # column_name, bookmark
-    def cash_management_entries(self, column_name=None, bookmark=None):
+    def cash_management_entries(self, column_name=None, bookmark=None, ledger=None):
+        ledger = ledger or WindowLedger()
         business_date = utils.strptime_with_tz(bookmark).strftime(self.fmt_date)
-        for single_date in daterange(utils.strptime_with_tz(business_date), datetime.now(pytz.utc)):
+        for (single_date, next_date) in ledger.pending(business_date_windows(utils.strptime_with_tz(business_date), datetime.now(pytz.utc))):
             logger.info('Hitting cash management entries endpoint at datetime {date}'.format(date=single_date))
             res = self._get(self._url('cashmgmt/v1/entries'), businessDate=single_date.strftime(self.fmt_date))
             logger.info('Returned {number} entries.'.format(number=len(res)))
             for item in res:
                 yield item
+            if self.is_business_date_closed(next_date):
+                ledger.mark_complete(single_date, next_date)
 
 
     # column_name, bookmark
-    def cash_management_deposits(self, column_name=None, bookmark=None):
+    def cash_management_deposits(self, column_name=None, bookmark=None, ledger=None):
+        ledger = ledger or WindowLedger()
         business_date = utils.strptime_with_tz(bookmark).strftime(self.fmt_date)
-        for single_date in daterange(utils.strptime_with_tz(business_date), datetime.now(pytz.utc)):
+        for (single_date, next_date) in ledger.pending(business_date_windows(utils.strptime_with_tz(business_date), datetime.now(pytz.utc))):
             logger.info('Hitting cash management deposits endpoint at date {date}'.format(date=single_date))
             res = self._get(self._url('cashmgmt/v1/deposits'), businessDate=single_date.strftime(self.fmt_date))
             logger.info('Returned {number} deposits.'.format(number=len(res)))
             for item in res:
                 yield item
+            if self.is_business_date_closed(next_date):
+                ledger.mark_complete(single_date, next_date)
 
 
     # full table sync
@@ -142,27 +209,31 @@ class Toast(object):
             yield item
 
 
-    def orders(self, column_name=None, bookmark=None):
-        business_date = utils.strptime_with_tz(bookmark).strftime(self.fmt_date_time)
-        
+    def orders(self, column_name=None, bookmark=None, ledger=None):
+        ledger = ledger or WindowLedger()
         format_string = '%Y-%m-%dT%H:%M:%S.000Z'
-        start_datetime = utils.strptime_with_tz(business_date).strftime(format_string)
-        end_datetime = datetime.now(pytz.utc).strftime(format_string)
-        page = 1
-        has_more = True
-        while has_more:
-            logger.info(f'Hitting orders endpoint between date {start_datetime} and {end_datetime} and page {page}')
-            res = self._get(self._url('orders/v2/ordersBulk'), startDate=start_datetime, endDate=end_datetime, page=page, pageSize=100)
-            for item in res:
-                yield item
-            has_more = len(res) > 0
-            page += 1
-
-
-    def payments(self, column_name=None, bookmark=None):
+        start_date = utils.strptime_with_tz(bookmark).astimezone(pytz.utc)
+        end_date = datetime.now(pytz.utc) - ORDERS_LOOKBACK
+        for (window_start, window_end) in ledger.pending(day_windows(start_date, end_date)):
+            start_datetime = window_start.strftime(format_string)
+            end_datetime = window_end.strftime(format_string)
+            page = 1
+            has_more = True
+            while has_more:
+                logger.info(f'Hitting orders endpoint between date {start_datetime} and {end_datetime} and page {page}')
+                res = self._get(self._url('orders/v2/ordersBulk'), startDate=start_datetime, endDate=end_datetime, page=page, pageSize=100)
+                for item in res:
+                    yield item
+                has_more = len(res) > 0
+                page += 1
+            ledger.mark_complete(window_start, window_end)
+
+
+    def payments(self, column_name=None, bookmark=None, ledger=None):
+        ledger = ledger or WindowLedger()
         # cycle through paidBusinessDate, refundBusinessDate, and voidBusinessDate
         business_date = utils.strptime_with_tz(bookmark).strftime(self.fmt_date)
-        for single_date in daterange(utils.strptime_with_tz(business_date), datetime.now(pytz.utc)):
+        for (single_date, next_date) in ledger.pending(business_date_windows(utils.strptime_with_tz(business_date), datetime.now(pytz.utc))):
             logger.info('Hitting endpoint at date {date}'.format(date=single_date))
             paid_res = self._get(self._url('orders/v2/payments'), paidBusinessDate=single_date.strftime(self.fmt_date))
             refund_res = self._get(self._url('orders/v2/payments'), refundBusinessDate=single_date.strftime(self.fmt_date))
@@ -171,6 +242,8 @@ class Toast(object):
             logger.info('Returned {number} payments.'.format(number=len(res)))
             for item in res:
                 yield self._get(self._url('orders/v2/payments/{payment_guid}'.format(payment_guid=item)))[0]
+            if self.is_business_date_closed(next_date):
+                ledger.mark_complete(single_date, next_date)
 
 
     def alternate_payment_types(self, column_name=None, bookmark=None):
@@ -0,0 +1,59 @@
+
+#
+# Module dependencies.
+#
+
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def pooled_session(pool_size=10):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class RateLimiter():
+    """ Spaces requests out to at most `requests_per_second`, across all threads sharing it. """
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class TokenCache():
+    """ Authorization tokens shared between clients, fetched once per key. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}
+        self.tokens = {}
+
+
+    def get(self, key, fetch):
+        with self.lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self.tokens:
+                self.tokens[key] = fetch()
+            return self.tokens[key]
+
+
+    def invalidate(self, key, token):
+        with self.lock:
+            if self.tokens.get(key) == token:
+                del self.tokens[key]
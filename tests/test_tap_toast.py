@@ -0,0 +1,457 @@
+import io
+import os
+import json
+import time
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+import pytz
+from singer import Transformer, utils
+from singer.catalog import Catalog
+
+from tap_toast import stream_priority
+from tap_toast.budget import Budget
+from tap_toast.discover import discover_streams
+from tap_toast.ledger import WindowLedger, LEDGER_KEY
+from tap_toast.plan import estimate_seconds, plan_stream
+from tap_toast.profiling import StreamProfiler
+from tap_toast.sink import FileSink, pyarrow
+from tap_toast.streams import Menus, Orders, Payments, compile_projection
+from tap_toast.sync import sync_stream
+from tap_toast.toast import Toast, business_date_windows, day_windows
+from tap_toast.transport import RateLimiter, TokenCache
+
+
+def day(n):
+    return datetime(2019, 2, 1, tzinfo=pytz.utc) + timedelta(n)
+
+
+class FakeToast(Toast):
+    """ A client answering `_get` from `responses`, keyed by url path and sorted query parameters. """
+
+    def __init__(self, responses):
+        super().__init__(start_date='2019-02-01T00:00:00Z', auth_with_login=False, tokens=self)
+        self.responses = responses
+
+
+    def get(self, key, fetch):
+        return 'token'
+
+
+    def _get(self, url, **kwargs):
+        key = (url[len(self.host):],) + tuple(sorted(kwargs.items()))
+        return self.responses.get(key, [])
+
+
+class TestWindowLedger(unittest.TestCase):
+
+    def new_ledger(self, state, checkpoints=None):
+        checkpoint = (lambda: checkpoints.append(True)) if checkpoints is not None else None
+        return WindowLedger(state, 'payments', 'paidDate', '2019-02-01T00:00:00Z', checkpoint)
+
+
+    def test_contiguous_windows_compact_into_bookmark(self):
+        state = {}
+        checkpoints = []
+        ledger = self.new_ledger(state, checkpoints)
+        for (start, end) in ledger.pending(business_date_windows(day(0), day(3))):
+            ledger.mark_complete(start, end)
+
+        self.assertEqual(state, {'bookmarks': {'payments': {'paidDate': '2019-02-04T00:00:00.000000Z'}}})
+        self.assertEqual(len(checkpoints), 3)
+
+
+    def test_out_of_order_windows_are_kept_until_contiguous(self):
+        state = {}
+        ledger = self.new_ledger(state)
+        ledger.mark_complete(day(2), day(3))
+
+        self.assertEqual(state['bookmarks']['payments']['paidDate'], '2019-02-01T00:00:00.000000Z')
+        self.assertEqual(state['bookmarks']['payments'][LEDGER_KEY],
+                         [['2019-02-03T00:00:00.000000Z', '2019-02-04T00:00:00.000000Z']])
+
+        ledger.mark_complete(day(0), day(1))
+        ledger.mark_complete(day(1), day(2))
+        self.assertEqual(state, {'bookmarks': {'payments': {'paidDate': '2019-02-04T00:00:00.000000Z'}}})
+
+
+    def test_resume_skips_completed_windows(self):
+        state = {'bookmarks': {'payments': {
+            'paidDate': '2019-02-02T00:00:00.000000Z',
+            LEDGER_KEY: [['2019-02-04T00:00:00.000000Z', '2019-02-05T00:00:00.000000Z']],
+        }}}
+        ledger = self.new_ledger(state)
+        pending = list(ledger.pending(business_date_windows(day(0), day(5))))
+
+        self.assertEqual(pending, [(day(1), day(2)), (day(2), day(3)), (day(4), day(5))])
+
+
+    def test_bookmark_inside_a_window_refetches_that_window(self):
+        state = {'bookmarks': {'payments': {'paidDate': '2019-02-02T15:00:00.000000Z'}}}
+        ledger = self.new_ledger(state)
+        (start, end) = next(ledger.pending(business_date_windows(day(0), day(3))))
+
+        self.assertEqual((start, end), (day(1), day(2)))
+        ledger.mark_complete(start, end)
+        self.assertEqual(state['bookmarks']['payments']['paidDate'], '2019-02-03T00:00:00.000000Z')
+
+
+    def test_day_windows_are_cut_at_midnight(self):
+        windows = list(day_windows(day(0) + timedelta(hours=5), day(2) + timedelta(hours=1)))
+
+        self.assertEqual(windows, [
+            (day(0) + timedelta(hours=5), day(1)),
+            (day(1), day(2)),
+            (day(2), day(2) + timedelta(hours=1)),
+        ])
+
+
+    def test_open_business_date_is_fetched_but_left_pending(self):
+        today = datetime.now(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        client = FakeToast({})
+        requested = []
+        client._get = lambda url, **kwargs: requested.append(kwargs.get('businessDate')) or []
+        state = {}
+        bookmark = utils.strftime(today - timedelta(3))
+        ledger = WindowLedger(state, 'cash_management_entries', 'date', bookmark)
+        list(client.cash_management_entries('date', bookmark, ledger=ledger))
+
+        dates = [(today - timedelta(n)).strftime('%Y%m%d') for n in (3, 2, 1)]
+        self.assertEqual(requested, dates)
+        # yesterday's business date is still open in the restaurant's time zone
+        self.assertEqual(state['bookmarks']['cash_management_entries']['date'], utils.strftime(today - timedelta(1)))
+
+
+class FakeClock():
+
+    def __init__(self):
+        self.now = 0.0
+
+
+    def __call__(self):
+        return self.now
+
+
+class TestBudget(unittest.TestCase):
+
+    def test_without_a_limit_the_budget_never_runs_out(self):
+        budget = Budget(None, clock=FakeClock())
+        budget.observe('payments', 1000)
+        self.assertFalse(budget.exhausted('payments'))
+
+
+    def test_streams_are_guarded_by_their_own_slowest_window(self):
+        clock = FakeClock()
+        budget = Budget(100, default_seconds=5, clock=clock)
+        budget.observe('cash_management_entries', 2)
+        budget.observe('payments', 30)
+        clock.now = 75
+
+        self.assertFalse(budget.exhausted('cash_management_entries'))
+        self.assertTrue(budget.exhausted('payments'))
+        # a stream not timed yet expects the slowest window of any stream
+        self.assertTrue(budget.exhausted('orders'))
+
+
+    def test_first_window_is_guarded_by_the_default(self):
+        clock = FakeClock()
+        budget = Budget(100, default_seconds=60, clock=clock)
+        clock.now = 30
+        self.assertFalse(budget.exhausted('payments'))
+        clock.now = 45
+        self.assertTrue(budget.exhausted('payments'))
+
+
+    def test_ledger_stops_before_a_window_that_would_overrun(self):
+        clock = FakeClock()
+        state = {}
+        ledger = WindowLedger(state, 'payments', 'paidDate', '2019-02-01T00:00:00Z', budget=Budget(25, default_seconds=5, clock=clock))
+        for (start, end) in ledger.pending(business_date_windows(day(0), day(5))):
+            clock.now += 10
+            ledger.mark_complete(start, end)
+
+        self.assertEqual(clock.now, 20)
+        self.assertEqual(state['bookmarks']['payments']['paidDate'], '2019-02-03T00:00:00.000000Z')
+
+
+    def test_full_table_streams_go_first_then_the_furthest_behind(self):
+        catalog = Catalog.from_dict({'streams': discover_streams(None)})
+        state = {'bookmarks': {
+            'payments': {'paidDate': '2019-03-01T00:00:00Z'},
+            'orders': {'modifiedDate': '2019-02-10T00:00:00Z'},
+        }}
+        config = {'start_date': '2019-01-01T00:00:00Z'}
+        streams = [stream.tap_stream_id for stream in sorted(catalog.streams, key=lambda stream: stream_priority(stream, state, config))]
+
+        incremental = ['cash_management_entries', 'cash_management_deposits', 'orders', 'payments']
+        self.assertEqual(streams[-4:], incremental)
+        self.assertNotIn('orders', streams[:-4])
+
+
+class TestPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.today = datetime.now(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.state = {'bookmarks': {
+            'payments': {'paidDate': utils.strftime(self.today - timedelta(5))},
+            'orders': {'modifiedDate': utils.strftime(self.today - timedelta(3))},
+        }}
+
+
+    def test_requests_are_counted_per_endpoint_and_window(self):
+        instance = Payments(FakeToast({}), {'start_date': '2019-02-01T00:00:00Z'})
+        stream_plan = plan_stream(instance, self.state)
+
+        self.assertEqual(stream_plan['windows'], 5)
+        self.assertEqual(stream_plan['requests'], {'orders/v2/payments': 15})
+        self.assertFalse(stream_plan['calibrated'])
+
+
+    def test_sampled_windows_are_scaled_up(self):
+        yesterday = (self.today - timedelta(1)).strftime('%Y%m%d')
+        guids = ['3f6a1b2c-0000-0000-0000-00000000000{}'.format(n) for n in range(2)]
+        responses = {('orders/v2/payments', ('paidBusinessDate', yesterday)): guids}
+        responses.update({('orders/v2/payments/' + guid,): [{'guid': guid}] for guid in guids})
+        instance = Payments(FakeToast(responses), {'start_date': '2019-02-01T00:00:00Z'})
+        stream_plan = plan_stream(instance, self.state, sample_windows=2)
+
+        self.assertTrue(stream_plan['calibrated'])
+        self.assertEqual(stream_plan['sampled_windows'], 2)
+        self.assertEqual(stream_plan['records_per_window'], 1)
+        self.assertEqual(stream_plan['requests'], {'orders/v2/payments': 15, 'orders/v2/payments/{guid}': 5})
+
+
+    def test_todays_partial_orders_window_is_not_sampled(self):
+        (start, end) = (self.today - timedelta(1), self.today)
+        window = (('endDate', end.strftime('%Y-%m-%dT%H:%M:%S.000Z')), ('page', 1), ('pageSize', 100), ('startDate', start.strftime('%Y-%m-%dT%H:%M:%S.000Z')))
+        client = FakeToast({('orders/v2/ordersBulk',) + window: [{'guid': 'a'}]})
+        instance = Orders(client, {'start_date': '2019-02-01T00:00:00Z'})
+        stream_plan = plan_stream(instance, self.state, sample_windows=1)
+
+        self.assertEqual(stream_plan['records_per_window'], 1)
+        self.assertEqual(stream_plan['requests'], {'orders/v2/ordersBulk': 2 * stream_plan['windows']})
+
+
+    def test_estimate_is_latency_bound_unless_rate_limited(self):
+        self.assertEqual(estimate_seconds(100, 0.5), 50)
+        self.assertEqual(estimate_seconds(100, 0.5, requests_per_second=10), 50)
+        self.assertEqual(estimate_seconds(100, 0.5, requests_per_second=1), 100)
+
+
+class TestPassthroughProjection(unittest.TestCase):
+
+    schema = {'type': ['null', 'object'], 'properties': {
+        'guid': {'type': ['null', 'string']},
+        'name': {'type': ['string', 'null']},
+        'visible': {'type': ['null', 'boolean']},
+        'parent': {'type': ['null', 'object'], 'properties': {'guid': {'type': ['null', 'string']}}},
+        'images': {'type': ['null', 'array'], 'items': {'type': ['null', 'string']}},
+        'anything': {},
+    }}
+
+
+    def transform(self, record):
+        with Transformer() as transformer:
+            return transformer.transform(record, self.schema)
+
+
+    def test_matches_the_transformer(self):
+        project = compile_projection(self.schema)
+        records = [
+            {'guid': 'a', 'name': '', 'visible': True, 'parent': None, 'images': [], 'anything': {'x': [1]}},
+            {'guid': None, 'name': None, 'parent': {'guid': 'b', 'undeclared': 1}, 'images': ['c', None], 'undeclared': 2},
+            {'guid': '', 'parent': ''},
+        ]
+        for record in records:
+            self.assertEqual(project(record), self.transform(record))
+
+
+    def test_values_needing_coercion_raise(self):
+        project = compile_projection(self.schema)
+        for record in ({'guid': 5}, {'visible': 'false'}, {'visible': None}, {'images': 'c'}):
+            with self.assertRaises(ValueError):
+                project(record)
+
+
+    def test_schemas_with_coerced_types_are_not_compiled(self):
+        self.assertIsNone(compile_projection({'type': ['null', 'integer']}))
+        self.assertIsNone(compile_projection({'type': ['null', 'string'], 'format': 'date-time'}))
+        self.assertIsNone(compile_projection({'type': 'object', 'properties': {'n': {'type': 'number'}}}))
+
+
+    def test_fast_path_is_opt_in_under_either_config_key(self):
+        catalog = Catalog.from_dict({'streams': discover_streams(None)})
+        for (config, enabled) in (({}, False), ({'transform_fast_path': True}, True), ({'raw_passthrough': True}, True)):
+            instance = Menus(None, dict(config, start_date='2019-02-01T00:00:00Z'))
+            instance.stream = catalog.get_stream('menus')
+            self.assertEqual(instance.passthrough_projection() is not None, enabled)
+
+
+class TestFileSink(unittest.TestCase):
+
+    def test_state_waits_for_a_batch_to_be_written(self):
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as output_dir:
+            sink = FileSink(output_dir, batch_size=3, out=out)
+            sink.write_schema('cash_management_entries', {'properties': {}}, ['guid'])
+            for n in range(4):
+                sink.write_record('cash_management_entries', {'guid': str(n)})
+                sink.write_state({'bookmarks': {'cash_management_entries': {'date': n}}})
+
+            states = [json.loads(line)['value'] for line in out.getvalue().splitlines()]
+            # the state after the batch covers nothing unwritten, so it does not wait
+            self.assertEqual(states, [{'bookmarks': {'cash_management_entries': {'date': n}}} for n in (1, 2)])
+            self.assertEqual(len(sink.files), 1)
+
+            sink.close()
+            states = [json.loads(line)['value'] for line in out.getvalue().splitlines()]
+            self.assertEqual(states[-1], {'bookmarks': {'cash_management_entries': {'date': 3}}})
+            self.assertEqual([f['records'] for f in sink.files], [3, 1])
+
+
+    def test_state_covering_no_buffered_records_goes_out_right_away(self):
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as output_dir:
+            sink = FileSink(output_dir, out=out)
+            sink.write_state({'bookmarks': {'cash_management_entries': {'date': 0}}})
+
+            states = [json.loads(line)['value'] for line in out.getvalue().splitlines()]
+            self.assertEqual(states, [{'bookmarks': {'cash_management_entries': {'date': 0}}}])
+            self.assertEqual(sink.files, [])
+
+
+    def test_state_flushes_a_small_batch_after_flush_seconds(self):
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as output_dir:
+            sink = FileSink(output_dir, out=out, flush_seconds=60)
+            sink.write_schema('cash_management_entries', {'properties': {}}, ['guid'])
+            sink.write_record('cash_management_entries', {'guid': '0'})
+            sink.write_state({'bookmarks': {'cash_management_entries': {'date': 0}}})
+            self.assertEqual(out.getvalue(), '')
+
+            sink.flushed_at -= 60
+            sink.write_record('cash_management_entries', {'guid': '1'})
+            sink.write_state({'bookmarks': {'cash_management_entries': {'date': 1}}})
+
+            states = [json.loads(line)['value'] for line in out.getvalue().splitlines()]
+            self.assertEqual(states, [{'bookmarks': {'cash_management_entries': {'date': 1}}}])
+            self.assertEqual([f['records'] for f in sink.files], [2])
+
+    def test_windowed_records_are_partitioned_by_the_window_synced(self):
+        refund_guid = '3f6a1b2c-0000-0000-0000-000000000001'
+        client = FakeToast({
+            ('orders/v2/payments', ('refundBusinessDate', '20190203')): [refund_guid],
+            ('orders/v2/payments/' + refund_guid,): [{'guid': refund_guid, 'paidDate': '2019-01-15T12:00:00.000Z'}],
+        })
+        instance = Payments(client, {'start_date': '2019-02-01T00:00:00Z'})
+        instance.stream = Catalog.from_dict({'streams': discover_streams(None)}).get_stream('payments')
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            sink = FileSink(output_dir, out=io.StringIO())
+            sync_stream({}, instance, sink)
+            sink.close()
+
+            self.assertEqual([f['business_date'] for f in sink.files], ['20190203'])
+
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_columns_come_from_the_catalog_schema(self):
+        import pyarrow.parquet
+        schema = {'type': ['null', 'object'], 'properties': {
+            'guid': {'type': ['null', 'string']},
+            'amount': {'type': ['null', 'number']},
+            'parent': {'type': ['null', 'object'], 'properties': {'guid': {'type': ['null', 'string']}}},
+            'extra': {'type': ['null', 'object']},
+        }}
+        with tempfile.TemporaryDirectory() as output_dir:
+            sink = FileSink(output_dir, file_format='parquet', out=io.StringIO())
+            sink.write_schema('menus', schema, ['guid'])
+            sink.write_record('menus', {'guid': 'a'})
+            sink.write_record('menus', {'guid': 'b', 'amount': 1.5, 'parent': {'guid': 'c'}, 'extra': {'x': 1}})
+            sink.close()
+
+            table = pyarrow.parquet.read_table(os.path.join(output_dir, sink.files[0]['path']))
+            self.assertEqual(table.column_names, ['guid', 'amount', 'parent', 'extra'])
+            self.assertEqual(table.to_pylist()[1], {'guid': 'b', 'amount': 1.5, 'parent': {'guid': 'c'}, 'extra': '{"x": 1}'})
+
+
+    def test_locations_sharing_a_directory_write_separate_files(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            sinks = [FileSink(output_dir, out=io.StringIO(), location=location) for location in ('downtown', 'uptown')]
+            for sink in sinks:
+                sink.write_schema('menus', {'properties': {}}, ['guid'])
+                sink.write_record('menus', {'guid': sink.location})
+                sink.close()
+
+            paths = [f['path'] for sink in sinks for f in sink.files]
+            self.assertEqual(len(set(paths)), 2)
+            self.assertEqual(len([name for name in os.listdir(output_dir) if name.startswith('manifest-')]), 2)
+
+
+class TestTransport(unittest.TestCase):
+
+    def test_rate_limiter_spaces_requests_across_threads(self):
+        limiter = RateLimiter(50)
+        started = time.monotonic()
+        threads = [threading.Thread(target=limiter.acquire) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertGreaterEqual(time.monotonic() - started, 5 / 50.0)
+
+
+    def test_token_cache_fetches_once_per_key(self):
+        tokens = TokenCache()
+        fetched = []
+
+        def fetch():
+            fetched.append(True)
+            time.sleep(0.01)
+            return 'token-{}'.format(len(fetched))
+
+        threads = [threading.Thread(target=tokens.get, args=('client', fetch)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(fetched), 1)
+
+        tokens.invalidate('client', 'stale')
+        self.assertEqual(tokens.get('client', fetch), 'token-1')
+        tokens.invalidate('client', 'token-1')
+        self.assertEqual(tokens.get('client', fetch), 'token-2')
+
+
+class TestStreamProfiler(unittest.TestCase):
+
+    def test_reports_cover_time_stacks_and_freed_allocations(self):
+        def allocate():
+            rows = [str(n) * 20 for n in range(100000)]
+            time.sleep(0.05)
+            return len(rows)
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            with StreamProfiler(output_dir, 'orders'):
+                for _ in range(3):
+                    allocate()
+
+            with open(os.path.join(output_dir, 'orders.txt')) as f:
+                report = f.read()
+            with open(os.path.join(output_dir, 'orders.collapsed')) as f:
+                stacks = f.read().splitlines()
+
+        self.assertIn('Top functions by cumulative', report)
+        self.assertIn('allocate', report)
+        # the rows are freed before the profiler exits, yet their peak is reported
+        sites = [line for line in report.splitlines() if line.startswith(__file__)]
+        self.assertRegex(sites[0], r'size=[0-9.]+ (KiB|MiB)')
+        self.assertTrue(any(stack.split(' ')[0].endswith('{}:allocate'.format(__name__)) for stack in stacks))
+        self.assertTrue(all(stack.rsplit(' ', 1)[1].isdigit() for stack in stacks))
+
+
+if __name__ == '__main__':
+    unittest.main()